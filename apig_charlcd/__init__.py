@@ -31,12 +31,6 @@ import apigpio as apig
 # 16: LCD Backlight          - GND
 
 
-# LCD RAM address for the lines
-# to set the cursor position, these must be added with
-# _CMD_DDRAM_MASK
-_LCD_LINES = [0x0, 0b1000000, 0b10100, 0b1010100]
-
-
 # Styles when writting full lines
 STYLE_LEFT = 1
 STYLE_CENTERED = 2
@@ -65,6 +59,105 @@ _DISPLAY_ON = 0b0100
 _DISPLAY_CURSOR_ON = 0b0010
 _DISPLAY_CURSOR_BLINK = 0b001
 
+# Content of a cell after a clear
+_BLANK = ord(' ')
+
+
+class LcdGeometry(object):
+    """
+    Describes the layout of a screen: its size and, for each row, the
+    controller driving it and the DDRAM address of its first character.
+
+    The set DDRAM address command for every position is precomputed, so that
+    moving the cursor is a simple lookup.
+
+    Large screens (e.g. 40x4) use two HD44780 controllers sharing the RS and
+    data lines, each one with its own E line.
+    """
+
+    def __init__(self, cols, lines, row_addresses, row_controllers=None):
+        """
+        :param cols: number of characters on a line
+        :param lines: number of lines
+        :param row_addresses: DDRAM address of the first character of each
+        row, in the controller driving this row.
+        :param row_controllers: index of the controller driving each row,
+        all rows are on the first controller if not given.
+        """
+        if len(row_addresses) != lines:
+            raise ValueError('Expected {} row addresses, got {}'
+                             .format(lines, len(row_addresses)))
+        if row_controllers is None:
+            row_controllers = [0] * lines
+        if len(row_controllers) != lines:
+            raise ValueError('Expected {} row controllers, got {}'
+                             .format(lines, len(row_controllers)))
+        self.cols = cols
+        self.lines = lines
+        self.row_controllers = list(row_controllers)
+        self.controllers = max(self.row_controllers) + 1
+        # addresses[row][col] is the command moving the cursor to (col, row)
+        self.addresses = [[_CMD_DDRAM_MASK | (base + col)
+                           for col in range(cols)]
+                          for base in row_addresses]
+
+
+# Common screen geometries
+GEOMETRY_16X2 = LcdGeometry(16, 2, [0x00, 0x40])
+GEOMETRY_20X2 = LcdGeometry(20, 2, [0x00, 0x40])
+# A 20x4 screen is seen by the controller as a 40x2 screen, the third and
+# fourth lines being the continuation of the first and second ones.
+GEOMETRY_20X4 = LcdGeometry(20, 4, [0x00, 0x40, 0x14, 0x54])
+# A 40x4 screen is made of two 40x2 screens, each with its own controller.
+GEOMETRY_40X4 = LcdGeometry(40, 4, [0x00, 0x40, 0x00, 0x40], [0, 0, 1, 1])
+
+
+class TransportCost(object):
+    """
+    Cost model of the link to the screen, used by LcdScreen to pick the
+    cheapest way to update it. All costs are in seconds.
+
+    With pigpiod, the cost is dominated by the round trip of each call to the
+    daemon: a byte needs up to 8 calls (2 bank writes and 2 writes on E for
+    each nibble), the pin cache usually saves a few of them.
+    Moving the cursor between two runs of characters is more expensive than
+    sending a character: besides the command byte, RS must be driven low for
+    the command and high again for the next character, calls that the pin
+    cache cannot save.
+    """
+
+    def __init__(self, round_trip=0.0003, calls_per_byte=6, calls_per_move=8,
+                 clear_delay=0.003):
+        """
+        :param round_trip: duration of a call to pigpiod
+        :param calls_per_byte: average number of calls needed to send a byte
+        :param calls_per_move: average number of calls needed to move the
+        cursor in the middle of a run of characters.
+        :param clear_delay: time to wait after a clear command
+        """
+        self.round_trip = round_trip
+        self.calls_per_byte = calls_per_byte
+        self.calls_per_move = calls_per_move
+        self.clear_delay = clear_delay
+
+    def bytes_cost(self, count):
+        """
+        Cost of sending count bytes (characters or commands).
+        """
+        return count * self.calls_per_byte * self.round_trip
+
+    def move_cost(self):
+        """
+        Cost of moving the cursor.
+        """
+        return self.calls_per_move * self.round_trip
+
+    def clear_cost(self):
+        """
+        Cost of a hardware clear.
+        """
+        return self.bytes_cost(1) + self.clear_delay
+
 
 class LcdScreen(object):
     """
@@ -74,19 +167,61 @@ class LcdScreen(object):
 
     Most methods are coroutines and must be called using `yield from`.
 
+    The layout of the screen is given by the geometry argument, see
+    LcdGeometry. For screens with several controllers, e must be a list
+    with the E pin of each controller.
+
+    LcdScreen keeps a copy of the content of the screen and only sends the
+    characters that actually change. When many cells must change, it may
+    instead clear the screen and repaint the non-blank cells, whichever is
+    cheaper according to the cost argument, see TransportCost.
+
     """
 
-    def __init__(self, pi, e=None, rs=None, d4=None, d5=None, d6=None, d7=None):
+    def __init__(self, pi, e=None, rs=None, d4=None, d5=None, d6=None, d7=None,
+                 cache_pins=True, geometry=GEOMETRY_20X4, cost=None):
         self._pi = pi
 
         self._d = [d4, d5, d6, d7]
         self._rs = rs
-        self._e = e
+        if isinstance(e, (list, tuple)):
+            self._e = list(e)
+        else:
+            self._e = [e]
+        if len(self._e) != geometry.controllers:
+            raise ValueError('This geometry needs {} E pins, got {}'
+                             .format(geometry.controllers, len(self._e)))
+        self._e_masks = [1 << pin for pin in self._e]
+        self._e_all = sum(self._e_masks)
         self._lock = asyncio.Lock()
 
-        # TODO: manage 2 lines displays
-        self._lines = 4
-        self._cols = 20
+        # Last level driven on the pins we own, as bit masks using the same
+        # layout as pigpio bank 1: a pin is in _pins_high (resp. _pins_low)
+        # when we know it is currently high (resp. low). Pins in neither mask
+        # have an unknown level and are always written.
+        # This allows skipping most of the calls to pigpiod: RS rarely changes
+        # between two bytes, E is always low between two pulses and
+        # consecutive nibbles often share some bits.
+        self._cache_pins = cache_pins
+        self._pins_high = 0
+        self._pins_low = 0
+
+        self._geometry = geometry
+        self._lines = geometry.lines
+        self._cols = geometry.cols
+        # controller receiving characters written at the cursor position
+        self._controller = 0
+
+        self._cost = cost if cost is not None else TransportCost()
+        # Known content of the screen, as character codes indexed by
+        # [row][col], None for unknown cells.
+        self._screen = None
+        self.resync_screen()
+        # Position (col, row) where write_char writes, and actual position of
+        # the address counter of the active controller. They differ when
+        # unchanged characters were not sent. None when unknown.
+        self._cursor = None
+        self._hw_cursor = None
 
     @property
     def lines(self):
@@ -96,11 +231,40 @@ class LcdScreen(object):
     def cols(self):
         return self._cols
 
+    @property
+    def geometry(self):
+        return self._geometry
+
+    @property
+    def cost(self):
+        return self._cost
+
+    def resync_screen(self):
+        """
+        Forget the known content of the screen: the next writes will send
+        every character.
+        Use this when the screen may have been modified by something else.
+        """
+        self._screen = [[None] * self._cols for _ in range(self._lines)]
+
+    def resync_pins(self):
+        """
+        Forget the cached pin levels: the next writes will drive every pin
+        explicitly.
+        Use this when something else may have changed the gpio levels (e.g.
+        another pigpiod client or a restart of the daemon).
+        """
+        self._pins_high = 0
+        self._pins_low = 0
+
     @asyncio.coroutine
     def init(self):
         with (yield from self._lock):
+            # Setting the mode does not tell us anything about the levels.
+            self.resync_pins()
+
             # Only use output pins:
-            for pin in (self._d + [self._e, self._rs]):
+            for pin in (self._d + self._e + [self._rs]):
                 yield from self._pi.set_mode(pin, apig.OUTPUT)
 
             # ATM, script is not used for pulsing e, as it seems to be less
@@ -130,19 +294,24 @@ class LcdScreen(object):
         # create pigpio script for pulse on e
         # pigs proc w <e> 1 mics 20 w<e> 0
 
-        script = 'w {e} 0 mics 10 w {e} 1 mics 10 w {e} 0 mics 10'.format(e=self._e)
+        script = 'w {e} 0 mics 10 w {e} 1 mics 10 w {e} 0 mics 10'.format(
+            e=self._e[0])
         self._sc_id = yield from self._pi.store_script(script)
         # FIXME must delete script at end otherwise we might running out of room
 
     @asyncio.coroutine
-    def _send_byte(self, bits, mode):
+    def _send_byte(self, bits, mode, e_mask=None):
         """
         Send a byte to the display, in two 4-bits nibbles.
         This implementation uses the set/unset bank method from pigpio for better
         performance.
         :param bits:
         :param mode: command or character ( _LCD_CMD, _LCD_CHR)
+        :param e_mask: bank 1 mask of the E pins of the controllers receiving
+        the byte, all controllers if None.
         """
+        if e_mask is None:
+            e_mask = self._e_all
 
         # Using pigpio set_bank_1() and clear_bank_1() to set all gpio in one
         # call.
@@ -192,11 +361,10 @@ class LcdScreen(object):
             set_mask += (bits >> i & 1) << self._d[i % 4]
             unset_mask += (bits >> i & 1 ^ 1) << self._d[i % 4]
 
-        yield from self._pi.clear_bank_1(unset_mask)
-        yield from self._pi.set_bank_1(set_mask)
+        yield from self._write_bank(set_mask, unset_mask)
 
         # Toggle 'Enable' pin
-        yield from self._toggle_enable()
+        yield from self._toggle_enable(e_mask)
 
         # same thing for low bits
         set_mask = 0
@@ -205,11 +373,38 @@ class LcdScreen(object):
             set_mask += (bits >> i & 1) << self._d[i % 4]
             unset_mask += (bits >> i & 1 ^ 1) << self._d[i % 4]
 
-        yield from self._pi.clear_bank_1(unset_mask)
-        yield from self._pi.set_bank_1(set_mask)
+        yield from self._write_bank(set_mask, unset_mask)
 
         # Toggle 'Enable' pin
-        yield from self._toggle_enable()
+        yield from self._toggle_enable(e_mask)
+
+    @asyncio.coroutine
+    def _write_bank(self, set_mask, clear_mask):
+        """
+        Drive the pins in set_mask high and the pins in clear_mask low, in at
+        most two calls to pigpiod.
+        Pins that are already known to be at the requested level are skipped,
+        and no call is made at all if nothing changes.
+        :param set_mask: bank 1 mask of the pins to set
+        :param clear_mask: bank 1 mask of the pins to clear
+        """
+        if self._cache_pins:
+            set_mask &= ~self._pins_high
+            clear_mask &= ~self._pins_low
+        try:
+            if clear_mask:
+                yield from self._pi.clear_bank_1(clear_mask)
+                self._pins_low |= clear_mask
+                self._pins_high &= ~clear_mask
+            if set_mask:
+                yield from self._pi.set_bank_1(set_mask)
+                self._pins_high |= set_mask
+                self._pins_low &= ~set_mask
+        except BaseException:
+            # We cannot know what has actually been applied, this includes
+            # cancellation which is not an Exception on recent pythons.
+            self.resync_pins()
+            raise
 
     @asyncio.coroutine
     def _toggle_enable_script(self):
@@ -230,19 +425,22 @@ class LcdScreen(object):
                 return
         return
 
-    def _toggle_enable(self):
+    def _toggle_enable(self, e_mask):
         import time
-        yield from self._pi.write(self._e, 0)
-        end = time.time() + (E_DELAY/1000000.0)
-        while time.time() < end:
-            pass
+        # E is low between two pulses, this first write is only needed when
+        # its level is not known.
+        if not self._cache_pins or self._pins_low & e_mask != e_mask:
+            yield from self._write_bank(0, e_mask)
+            end = time.time() + (E_DELAY/1000000.0)
+            while time.time() < end:
+                pass
 
-        yield from self._pi.write(self._e, 1)
+        yield from self._write_bank(e_mask, 0)
         end = time.time() + (E_DELAY/1000000.0)
         while time.time() < end:
             pass
 
-        yield from self._pi.write(self._e, 0)
+        yield from self._write_bank(0, e_mask)
         end = time.time() + (E_DELAY/1000000.0)
         while time.time() < end:
             pass
@@ -255,12 +453,40 @@ class LcdScreen(object):
         The message can be either an ascii string or an array of 2-bytes
         character codes (which are specific to the display and the ROM used
         in the display).
-        :param line: the line (0, ...3)
+        :param line: the line (0, ..., lines-1)
+        :param style: STYLE_xxx constant
+        """
+        data = self.format_line(message, style)
+        with (yield from self._lock):
+            yield from self._write_rows(0, [(line, data)])
+
+    @asyncio.coroutine
+    def write_lines(self, messages, style, first=0):
+        """
+        Write several full lines of text, starting at line first.
+
+        On screens with several controllers, lines driven by different
+        controllers are written together: the characters common to both
+        lines are sent once to all controllers and the others are
+        interleaved, so that both halves of the screen are updated at the
+        same time instead of one after the other.
+        :param messages: list of messages, see write_line
         :param style: STYLE_xxx constant
+        :param first: the line of the first message
         """
+        rows = [(first + i, self.format_line(message, style))
+                for i, message in enumerate(messages)]
+        with (yield from self._lock):
+            yield from self._write_rows(0, rows)
 
-        # TODO : optimization, do not write ' ' to align when not necessary
-        # might be solved when using a screen buffer
+    def format_line(self, message, style):
+        """
+        Pad message to the width of the screen according to style, as done
+        by write_line.
+        :param message: see write_line
+        :param style: STYLE_xxx constant
+        :return: a list of character codes of at most cols items
+        """
         data = []
         if isinstance(message, str):
             if style == STYLE_LEFT:
@@ -279,29 +505,184 @@ class LcdScreen(object):
             elif style == STYLE_CENTERED:
                 l = int(len(pad)/2)
                 data = pad[:l] + message + pad[:l+1]
+        return data[:self._cols]
 
-        with (yield from self._lock):
-            yield from self._move_to(0, line)
+    @asyncio.coroutine
+    def _write_rows(self, col, rows):
+        """
+        Write characters on one or several rows, starting at column col.
+        Only the characters that differ from the current content of the
+        screen are actually sent.
+        :param col: the column of the first character for all rows
+        :param rows: list of (row, data) where data is a list of character
+        codes.
+        """
+        targets = {}
+        for row, data in rows:
+            self._check_position(col, row)
+            cells = targets.get(row, list(self._screen[row]))
+            for i, char in enumerate(data[:self._cols - col]):
+                cells[col + i] = char
+            targets[row] = cells
+
+        yield from self._update(targets)
+
+        if rows:
+            row, data = rows[-1]
+            end = col + len(data)
+            self._cursor = (end, row) if end < self._cols else None
+
+    def _plan_row(self, cells, current):
+        """
+        Find the runs of cells that must be sent to turn current into cells.
+        Two runs are merged when rewriting the unchanged cells between them
+        is not more expensive than moving the cursor, which depends on the
+        ratio between the calls_per_move and calls_per_byte of the model.
+        :return: (runs, cost) where runs is a list of [start, end[ columns
+        """
+        move_cost = self._cost.move_cost()
+        runs = []
+        for i, (cell, cur) in enumerate(zip(cells, current)):
+            if cell == cur:
+                continue
+            if runs and self._cost.bytes_cost(i - runs[-1][1]) <= move_cost:
+                runs[-1][1] = i + 1
+            else:
+                runs.append([i, i + 1])
+        cost = sum(move_cost + self._cost.bytes_cost(end - start)
+                   for start, end in runs)
+        return runs, cost
 
-            for i in range(self._cols):
-                yield from self._send_byte(data[i], _LCD_CHR)
+    @asyncio.coroutine
+    def _update(self, targets):
+        """
+        Bring the screen to the content given in targets, using the cheapest
+        of selective overwrites and a hardware clear followed by a repaint of
+        the non-blank cells.
+        :param targets: dict mapping a row to the list of its cells
+        """
+        runs = {}
+        cost = 0
+        for row, cells in targets.items():
+            runs[row], row_cost = self._plan_row(cells, self._screen[row])
+            cost += row_cost
+
+        # A clear is only possible if we know what to repaint.
+        final = [targets.get(row, self._screen[row])
+                 for row in range(self._lines)]
+        if cost > self._cost.clear_cost() and \
+                all(None not in cells for cells in final):
+            blank = [_BLANK] * self._cols
+            clear_runs = {}
+            clear_cost = self._cost.clear_cost()
+            for row, cells in enumerate(final):
+                clear_runs[row], row_cost = self._plan_row(cells, blank)
+                clear_cost += row_cost
+            if clear_cost < cost:
+                yield from self._clear()
+                runs = clear_runs
+                targets = dict(enumerate(final))
+
+        yield from self._send_runs(targets, runs)
+
+    @asyncio.coroutine
+    def _send_runs(self, targets, runs):
+        """
+        Send runs of cells to the screen.
+
+        Runs starting at the same DDRAM address on different controllers are
+        grouped: the cursor of all these controllers is moved with a single
+        command and each character is sent once to all the controllers that
+        must display it.
+        :param targets: dict mapping a row to the list of its cells
+        :param runs: dict mapping a row to a list of [start, end[ columns
+        """
+        groups = []
+        for row, row_runs in runs.items():
+            controller = self._geometry.row_controllers[row]
+            for start, end in row_runs:
+                address = self._geometry.addresses[row][start]
+                run = (row, start, targets[row][start:end])
+                for group_address, group in groups:
+                    if group_address == address and controller not in group:
+                        group[controller] = run
+                        break
+                else:
+                    groups.append((address, {controller: run}))
+
+        for address, group in groups:
+            # No need to move when the active controller is already there.
+            hw_cursor, self._hw_cursor = self._hw_cursor, None
+            run = group.get(self._controller)
+            if len(group) > 1 or run is None or hw_cursor != (run[1], run[0]):
+                e_mask = sum(self._e_masks[c] for c in group)
+                yield from self._send_byte(address, _LCD_CMD, e_mask)
+
+            length = max(len(data) for _, _, data in group.values())
+            for i in range(length):
+                # e_mask for each distinct character at this position
+                chars = {}
+                for controller, (row, start, data) in group.items():
+                    if i < len(data):
+                        chars[data[i]] = chars.get(data[i], 0) | \
+                            self._e_masks[controller]
+                for char, e_mask in chars.items():
+                    yield from self._send_byte(char, _LCD_CHR, e_mask)
+                for controller, (row, start, data) in group.items():
+                    if i < len(data):
+                        self._screen[row][start + i] = data[i]
+
+            for controller, (row, start, data) in group.items():
+                self._controller = controller
+                end = start + len(data)
+                self._hw_cursor = (end, row) if end < self._cols else None
 
     @asyncio.coroutine
     def clear(self):
         """
-        Clear the screen
+        Clear the screen and move the cursor to (0, 0).
+        Only the cells that are not already blank are cleared, unless a
+        hardware clear is cheaper.
         """
         with (yield from self._lock):
-            yield from self._clear()
+            yield from self._fill(0, 0, self._cols, self._lines, _BLANK)
+            self._cursor = (0, 0)
+
+    @asyncio.coroutine
+    def fill(self, col, row, width, height, char=_BLANK):
+        """
+        Fill a rectangular region of the screen with a character, e.g. to
+        clear a part of the screen.
+        :param col: left column of the region
+        :param row: top row of the region
+        :param width: number of columns, truncated to the screen width
+        :param height: number of rows
+        :param char: a character or a character code, blank by default.
+        """
+        if isinstance(char, str):
+            char = ord(char)
+        with (yield from self._lock):
+            yield from self._fill(col, row, width, height, char)
+
+    @asyncio.coroutine
+    def _fill(self, col, row, width, height, char):
+        data = [char] * min(width, self._cols - col)
+        yield from self._write_rows(col, [(r, data)
+                                          for r in range(row, row + height)])
 
     def _clear(self):
         yield from self._send_byte(_CMD_CLEAR, _LCD_CMD)
-        yield from asyncio.sleep(0.003)
+        self._screen = [[_BLANK] * self._cols for _ in range(self._lines)]
+        self._controller = 0
+        self._cursor = self._hw_cursor = (0, 0)
+        yield from asyncio.sleep(self._cost.clear_delay)
 
     @asyncio.coroutine
     def home(self):
         with (yield from self._lock):
             yield from self._send_byte(_CMD_HOME, _LCD_CMD)
+            self._controller = 0
+            self._cursor = self._hw_cursor = (0, 0)
             yield from asyncio.sleep(0.003)
 
     @asyncio.coroutine
@@ -317,11 +698,19 @@ class LcdScreen(object):
 
     @asyncio.coroutine
     def _move_to(self, col, row):
-        if row > (self._lines-1):
-            row = self._lines - 2
+        self._check_position(col, row)
         # Set location.
-        ddram_address = _CMD_DDRAM_MASK | col + _LCD_LINES[row]
-        yield from self._send_byte(ddram_address, _LCD_CMD)
+        self._controller = self._geometry.row_controllers[row]
+        self._hw_cursor = None
+        yield from self._send_byte(self._geometry.addresses[row][col],
+                                   _LCD_CMD,
+                                   self._e_masks[self._controller])
+        self._cursor = self._hw_cursor = (col, row)
+
+    def _check_position(self, col, row):
+        if not 0 <= row < self._lines or not 0 <= col < self._cols:
+            raise ValueError('Invalid position ({}, {}) for a {}x{} screen'
+                             .format(col, row, self._cols, self._lines))
 
     @asyncio.coroutine
     def write_char(self, char):
@@ -332,7 +721,27 @@ class LcdScreen(object):
         :return:
         """
         with (yield from self._lock):
-            yield from self._send_byte(char, _LCD_CHR)
+            if self._cursor is None:
+                # We do not know where this character goes.
+                yield from self._send_byte(char, _LCD_CHR,
+                                           self._e_masks[self._controller])
+                self.resync_screen()
+                return
+
+            col, row = self._cursor
+            if self._screen[row][col] != char:
+                if self._hw_cursor != self._cursor:
+                    yield from self._move_to(col, row)
+                self._hw_cursor = None
+                yield from self._send_byte(char, _LCD_CHR,
+                                           self._e_masks[self._controller])
+                self._screen[row][col] = char
+                self._hw_cursor = (col + 1, row)
+            col += 1
+            if col >= self._cols:
+                self._cursor = self._hw_cursor = None
+            else:
+                self._cursor = (col, row)
 
     @asyncio.coroutine
     def write_at(self, col, row, text):
@@ -343,17 +752,13 @@ class LcdScreen(object):
         :param row:
         :return:
         """
-        yield from self.move_to(col, row)
         if isinstance(text, str):
             data = [ord(c) for c in text]
         else:
             data = text
 
-        m = min(self._cols, len(data))
         with (yield from self._lock):
-            yield from self._move_to(col, row)
-            for i in range(m):
-                yield from self._send_byte(data[i], _LCD_CHR)
+            yield from self._write_rows(col, [(row, data)])
 
     @asyncio.coroutine
     def enable(self, enabled):
@@ -377,10 +782,234 @@ class LcdScreen(object):
         character.
 
         To show your custom character use eg. lcd.message('\x01')
+
+        On screens with several controllers, the character is defined on all
+        of them.
         """
         # only position 0..7 are allowed
         location &= 0x7
         with (yield from self._lock):
+            # The address counter now points to CGRAM.
+            self._hw_cursor = None
             yield from self._send_byte(_CMD_CGRAM_MASK | (location << 3), _LCD_CMD)
             for i in range(8):
                 yield from self._send_byte(pattern[i], _LCD_CHR)
+
+
+# Priorities for scheduled updates, lower values are sent first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class _Update(object):
+    """
+    An update waiting in an UpdateScheduler.
+
+    cells holds the characters still to be sent, starting at column col,
+    with None for the cells already sent or overwritten by a later update.
+    """
+
+    def __init__(self, col, row, data, priority, deadline, seq, future):
+        self.col = col
+        self.row = row
+        self.cells = list(data)
+        self.priority = priority
+        self.deadline = deadline
+        self.seq = seq
+        self.future = future
+        # timer reporting the deadline as missed, if it passes first
+        self.timer = None
+        self.missed = False
+
+    def key(self):
+        # highest priority first, then earliest deadline, then arrival order
+        deadline = self.deadline if self.deadline is not None else float('inf')
+        return self.priority, deadline, self.seq
+
+    def supersede(self, col, row, length):
+        """
+        Drop the cells that will be overwritten by a later update.
+        """
+        if row != self.row:
+            return
+        start = max(col - self.col, 0)
+        end = min(col + length - self.col, len(self.cells))
+        for i in range(start, end):
+            self.cells[i] = None
+
+    def next_chunk(self, size):
+        """
+        Take the next run of at most size consecutive cells to send.
+        :return: (col, data), or None if there is nothing left to send.
+        """
+        start = 0
+        while start < len(self.cells) and self.cells[start] is None:
+            start += 1
+        if start == len(self.cells):
+            return None
+        end = start
+        while end < len(self.cells) and end - start < size and \
+                self.cells[end] is not None:
+            end += 1
+        data = self.cells[start:end]
+        for i in range(start, end):
+            self.cells[i] = None
+        return self.col + start, data
+
+    def pending(self):
+        return any(c is not None for c in self.cells)
+
+
+class UpdateScheduler(object):
+    """
+    Sends updates to a LcdScreen by priority instead of in arrival order.
+
+    Updates are split into chunks of a few characters and, after each chunk,
+    the most urgent pending update is selected again. An urgent update
+    (e.g. an alarm line) therefore only waits for the chunk being sent,
+    instead of waiting for a whole screen repaint to complete.
+
+    Updates are ordered by priority (PRIORITY_xxx constants, or any number,
+    lower first), then by deadline, then by arrival order. Priority always
+    comes first: a deadline only orders updates of the same priority, so a
+    low priority update with a short deadline still waits for all the
+    updates of higher priority. A deadline is reported as missed as soon as
+    it passes, even if the update is still waiting. When an update
+    overwrites cells of an older update that have not been sent yet, these
+    cells are dropped from the older update, so that the screen always ends
+    up showing the latest content.
+
+    The scheduler must be started with start() and only sends its updates
+    through the public methods of LcdScreen, so it can be used alongside
+    direct calls to the screen.
+    """
+
+    def __init__(self, lcd, chunk_size=4):
+        """
+        :param lcd: the LcdScreen to update
+        :param chunk_size: maximum number of characters sent between two
+        scheduling decisions.
+        """
+        self._lcd = lcd
+        self._chunk_size = chunk_size
+        # Like the lock of LcdScreen, everything uses the default loop.
+        self._loop = asyncio.get_event_loop()
+        self._updates = []
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._stopping = False
+
+        # Number of updates that missed their deadline
+        self.missed_deadlines = 0
+        # Called with (col, row) of an update when its deadline passes before
+        # it is completed.
+        self.on_deadline_missed = None
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = self._loop.create_task(self._run())
+
+    @asyncio.coroutine
+    def stop(self):
+        """
+        Stop sending updates. Pending updates are cancelled.
+
+        The chunk being sent, if any, is completed first: cancelling it in
+        the middle of a byte would leave the screen in an unknown state.
+        """
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            yield from self._task
+            self._task = None
+        for update in self._updates:
+            if update.timer is not None:
+                update.timer.cancel()
+            update.future.cancel()
+        self._updates = []
+
+    def submit(self, col, row, text, priority=PRIORITY_NORMAL, deadline=None):
+        """
+        Schedule writing text at (col, row), see LcdScreen.write_at.
+
+        :param priority: PRIORITY_xxx constant
+        :param deadline: delay, in seconds, in which the update should be
+        completed or None.
+        :return: a future whose result is True when the update has been
+        completed in time, and False if it missed its deadline.
+        """
+        if isinstance(text, str):
+            data = [ord(c) for c in text]
+        else:
+            data = list(text)
+        data = data[:max(self._lcd.cols - col, 0)]
+
+        for update in self._updates:
+            update.supersede(col, row, len(data))
+
+        if deadline is not None:
+            deadline += self._loop.time()
+        future = asyncio.Future(loop=self._loop)
+        update = _Update(col, row, data, priority, deadline, self._seq,
+                         future)
+        if deadline is not None:
+            update.timer = self._loop.call_at(deadline, self._miss, update)
+        self._updates.append(update)
+        self._seq += 1
+        self._wakeup.set()
+        return future
+
+    def submit_line(self, message, line, style, priority=PRIORITY_NORMAL,
+                    deadline=None):
+        """
+        Schedule writing a full line of text, see LcdScreen.write_line.
+        """
+        data = self._lcd.format_line(message, style)
+        return self.submit(0, line, data, priority, deadline)
+
+    @asyncio.coroutine
+    def _run(self):
+        while not self._stopping:
+            if not self._updates:
+                self._wakeup.clear()
+                yield from self._wakeup.wait()
+                continue
+
+            update = min(self._updates, key=_Update.key)
+            chunk = update.next_chunk(self._chunk_size)
+            if chunk is not None:
+                col, data = chunk
+                try:
+                    yield from self._lcd.write_at(col, update.row, data)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self._updates.remove(update)
+                    if update.timer is not None:
+                        update.timer.cancel()
+                    if not update.future.done():
+                        update.future.set_exception(e)
+                    continue
+            if not update.pending():
+                self._updates.remove(update)
+                self._complete(update)
+
+    def _miss(self, update):
+        if update.missed:
+            return
+        update.missed = True
+        self.missed_deadlines += 1
+        if self.on_deadline_missed is not None:
+            self.on_deadline_missed(update.col, update.row)
+
+    def _complete(self, update):
+        if update.timer is not None:
+            update.timer.cancel()
+            # The timer may not have run yet if the loop was busy.
+            if self._loop.time() > update.deadline:
+                self._miss(update)
+        if not update.future.done():
+            update.future.set_result(not update.missed)